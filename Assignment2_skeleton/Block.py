@@ -27,6 +27,12 @@ class Block:
         """
         Calculates the current_hash of the block from its content
         """
+        self.current_hash = self.calculate_hash()  # initializes self.current_hash
+
+    def calculate_hash(self):
+        """
+        :return: hash of the block content as a string, without modifying the block
+        """
         content_to_hash = ""  # will contain the content to hash as string
         content_to_hash += str(self.index)
         # We do not hash the timestamp because when the genesis block is created, it is created at slightly (or big) different times by the peers
@@ -36,7 +42,22 @@ class Block:
         content_to_hash += self.previous_hash
         for transaction in self.transactions:
             content_to_hash += transaction  # will get the transaction in the string format tx|sender|content
-        self.current_hash = calculate_hash(content_to_hash)  # initializes self.current_hash
+        return calculate_hash(content_to_hash)
+
+    @staticmethod
+    def is_well_formed(block):
+        """
+        Checks that block is a Block whose fields have the expected types. Blocks received from other peers are
+        unpickled, so they might have been built with anything in them
+        :return: True if the block can be hashed and validated, False otherwise
+        """
+        if not isinstance(block, Block):
+            return False
+        fields = vars(block)
+        return isinstance(fields.get("index"), int) and isinstance(fields.get("timestamp"), (int, float)) and \
+            isinstance(fields.get("proof"), int) and isinstance(fields.get("previous_hash"), str) and \
+            isinstance(fields.get("current_hash"), str) and isinstance(fields.get("transactions"), list) and \
+            all(Transaction.is_well_formed(transaction) for transaction in block.transactions)
 
     def is_valid(self):
         """
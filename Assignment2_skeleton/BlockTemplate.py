@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+from Block import Block
+from Blockchain import Blockchain
+
+BLOCK_SIZE = 5  # number of transactions in a block
+
+
+def json_escape(data: str):
+    """
+    :return: data as it appears inside the json string calculate_hash builds from it (without the surrounding quotes)
+    """
+    return json.dumps(data)[1:-1]
+
+
+class BlockTemplate:
+    def __init__(self, index: int, transactions: list, previous_hash: str):
+        """
+        Candidate for the next block, assembled while the next proof is still being mined so that the block can be
+        sealed as soon as the proof arrives
+        :param index: index of the next block
+        :param transactions: list of transactions as strings in the format tx|sender|content
+        :param previous_hash: current_hash of the last block in the blockchain
+        """
+        self.index = index
+        self.transactions = transactions
+        self.previous_hash = previous_hash
+        # The block hash is the sha256 of the json string of index + proof + previous_hash + transactions (see Block)
+        # json escapes one character at a time, so everything but the proof can be escaped and hashed in advance:
+        # the hash state after the content before the proof, and the encoded content after the proof
+        self.prefix_hash = hashlib.sha256(('"' + json_escape(str(index))).encode())
+        self.suffix = (json_escape(previous_hash + "".join(transactions)) + '"').encode()
+
+    @staticmethod
+    def from_blockchain(blockchain: Blockchain):
+        """
+        Creates the template of the block that would follow the last block of blockchain
+        :return: BlockTemplate object, None if the pool does not contain enough transactions for a block
+        """
+        if blockchain.pool_length() < BLOCK_SIZE:
+            return None
+        return BlockTemplate(blockchain.get_previous_index() + 1, blockchain.peek_transactions(BLOCK_SIZE),
+                             blockchain.get_previous_block_hash())
+
+    def matches(self, blockchain: Blockchain):
+        """
+        Checks that the template still follows the last block of blockchain and contains the first transactions of its pool
+        :return: True if the template can be sealed on top of blockchain, False otherwise
+        """
+        return self.previous_hash == blockchain.get_previous_block_hash() and \
+            self.transactions == blockchain.peek_transactions(BLOCK_SIZE)
+
+    def seal(self, proof: int):
+        """
+        Completes the template with the proof
+        :param proof: integer, the next proof
+        :return: Block object
+        """
+        block_hash = self.prefix_hash.copy()
+        block_hash.update(json_escape(str(proof)).encode())
+        block_hash.update(self.suffix)
+        return Block(self.index, self.transactions, proof, self.previous_hash, block_hash.hexdigest())
+
+    def build(self, proof: int):
+        """
+        Completes the template with the proof, hashing the whole block as Block does (slower than seal)
+        :param proof: integer, the next proof
+        :return: Block object
+        """
+        return Block(self.index, self.transactions, proof, self.previous_hash)
+
+    @staticmethod
+    def check_seal():
+        """
+        seal builds the block hash the same way Block.calculate_hash and lib.calculate_hash do, without calling them.
+        Checks that the two hashes still match, also on content json escapes (quotes, control and non-ASCII characters)
+        :return: True if seal gives the same hash as Block.calculate_hash, False otherwise
+        """
+        transactions = ["tx|abcd1234|plain content", 'tx|abcd1234|"quoted" content', "tx|abcd1234|tab\there/slash",
+                        "tx|abcd1234|non-ASCII: caffè, 東京, ☕", "tx|abcd1234|control \x00\x1f\n"]
+        template = BlockTemplate(12, transactions, 'previous "hash" é')
+        for proof in (0, 7, 1234567890123456789):
+            block = template.seal(proof)
+            if block.current_hash != block.calculate_hash():
+                return False
+        return True
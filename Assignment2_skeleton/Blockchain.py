@@ -1,4 +1,5 @@
 from Block import Block
+from Transaction import Transaction
 
 
 class Blockchain:
@@ -13,6 +14,23 @@ class Blockchain:
         genesis_block = Block(1, self.transaction_pool, 100, "This block has no previous hash")
         self.add_new_block(genesis_block)
 
+    @staticmethod
+    def is_well_formed(blockchain):
+        """
+        Checks that blockchain is a Blockchain with at least a block, made of well formed blocks and transactions
+        (see Block.is_well_formed), for blockchains received from other peers
+        :return: True if the blockchain can be compared and validated, False otherwise
+        """
+        if not isinstance(blockchain, Blockchain):
+            return False
+        fields = vars(blockchain)
+        if not isinstance(fields.get("blockchain"), list) or not isinstance(fields.get("transaction_pool"), list):
+            return False
+        return len(blockchain.blockchain) > 0 and all(Block.is_well_formed(block) for block in blockchain.blockchain) and \
+            all(isinstance(transaction, Transaction) and isinstance(vars(transaction).get("sender"), str) and
+                isinstance(vars(transaction).get("content"), str) and
+                Transaction.is_well_formed(transaction.get_as_string()) for transaction in blockchain.transaction_pool)
+
     def add_new_block(self, block: Block):
         """
         Adds the new Block to the blockchain
@@ -55,17 +73,15 @@ class Blockchain:
         previous_block = self.get_previous_block()
         return previous_block.proof
 
-    def get_five_transactions(self):
+    def peek_transactions(self, count):
         """
-        Pops the from the transaction pool the first 5 transactions that have to be added into a new block
-        (pool might be bigger than 5 if transactions keep coming and the next_proof hasn't been found yet)
+        Returns the first count transactions of the transaction pool, that are the ones to be added into a new block
+        (pool might be bigger than count if transactions keep coming and the next_proof hasn't been found yet)
+        If count is None, all the transactions in the pool are returned
+        The transactions are not removed from the pool, the pool gets emptied when the new block is added
         :return: List of transactions as strings in the format tx|sender|content
         """
-        first_five_transactions = list()
-        for i in range(5):
-            # Remove get_as_string if we decide to handle transactions as normal string and not as objects
-            first_five_transactions.append(self.transaction_pool.pop(0).get_as_string())
-        return first_five_transactions
+        return [transaction.get_as_string() for transaction in self.transaction_pool[:count]]
 
     def blockchain_string(self):
         """
@@ -2,14 +2,16 @@ import _pickle
 import threading
 import socket
 
+from PeerManager import PeerManager
+
 HOST = "127.0.0.1"
 
 
 class BlockchainClient(threading.Thread):
-    def __init__(self, server_port_no, port_dict):
+    def __init__(self, server_port_no, peer_manager: PeerManager):
         super().__init__()
         self.server_port_no = server_port_no  # peer port number (server role)
-        self.port_dict = port_dict  # dictionary of all the neighbours with their port
+        self.peer_manager = peer_manager  # neighbours of the peer with their health
         self.alive = True
 
     def run(self):
@@ -20,6 +22,8 @@ class BlockchainClient(threading.Thread):
             print("Which action do you want to perform? (type the command)")
             print("tx) Transaction [tx|{sender}|{content}]")
             print("pb) Print Blockchain [pb]")
+            print("lq) Ledger Query [lq]")
+            print("ps) Pool Statistics [ps]")
             print("cc) Close Connection [cc]")
             choice = input()
             match choice:
@@ -28,6 +32,11 @@ class BlockchainClient(threading.Thread):
                 case "pb":
                     print_blockchain_thread = threading.Thread(target=self.print_blockchain)
                     print_blockchain_thread.start()
+                case "lq":
+                    self.ledger_query()
+                case "ps":
+                    pool_statistics_thread = threading.Thread(target=self.pool_statistics)
+                    pool_statistics_thread.start()
                 case "cc":
                     # CLIENT DIES
                     self.alive = False
@@ -68,21 +77,8 @@ class BlockchainClient(threading.Thread):
                     # print(f"Client {self.server_port_no} error RECEIVING TRANSACTION VALIDATION from server {self.server_port_no}")
                     # print(f"ERROR {e}")
 
-            # BROADCAST TO OTHER SERVERS THE TRANSACTION
-            for ID, PORT in self.port_dict.items():
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    try:
-                        s.connect((HOST, int(PORT)))
-                    except socket.error as e:
-                        pass
-                        # print(f"error CONNECTING with PEER {ID} at PORT: {PORT}")
-                        # print(f"ERROR {e}")
-                    try:
-                        s.sendall(bytes(transaction, encoding="utf-8"))
-                    except socket.error as e:
-                        pass
-                        # print(f"error SENDING TRANSACTION with PEER {ID} at PORT: {PORT}")
-                        # print(f"ERROR {e}")
+            # BROADCAST TO OTHER SERVERS THE TRANSACTION (in parallel, skipping the peers that are backing off)
+            self.peer_manager.broadcast(transaction)
         else: 
             print("Rejected")
 
@@ -118,6 +114,73 @@ class BlockchainClient(threading.Thread):
                 # print(f"Client {self.server_port_no} error RECEIVING BLOCKCHAIN from server {self.server_port_no}")
                 # print(f"ERROR {e}")
 
+    def ledger_query(self):
+        """
+        Asks the server the ledger state of a sender and prints it at terminal
+        """
+        print("Write the sender to query")
+        sender = input()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            # CONNECT TO SERVER
+            try:
+                s.connect((HOST, int(self.server_port_no)))
+            except socket.error as e:
+                pass
+                # print(f"Client {self.server_port_no} error CONNECTING with server {self.server_port_no}")
+                # print(f"ERROR {e}")
+
+            # SEND LQ REQUEST TO SERVER
+            try:
+                message = f"lq|{sender}"
+                s.sendall(bytes(message, encoding="utf-8"))
+            except socket.error as e:
+                pass
+                # print(f"Client {self.server_port_no} error SENDING LQ REQUEST to server {self.server_port_no}")
+                # print(f"ERROR {e}")
+
+            # RECEIVE SENDER STATE FROM SERVER
+            try:
+                received = s.recv(4096)
+                state = _pickle.loads(received)
+                print(f"Transactions: {state['transactions']} \nBalance: {state['balance']} \nNonce: {state['nonce']}")
+            except socket.error as e:
+                pass
+                # print(f"Client {self.server_port_no} error RECEIVING LEDGER STATE from server {self.server_port_no}")
+                # print(f"ERROR {e}")
+
+    def pool_statistics(self):
+        """
+        Asks the server the statistics of the miners attached to it and prints them at terminal
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            # CONNECT TO SERVER
+            try:
+                s.connect((HOST, int(self.server_port_no)))
+            except socket.error as e:
+                pass
+                # print(f"Client {self.server_port_no} error CONNECTING with server {self.server_port_no}")
+                # print(f"ERROR {e}")
+
+            # SEND PS REQUEST TO SERVER
+            try:
+                message = "ps"
+                s.sendall(bytes(message, encoding="utf-8"))
+            except socket.error as e:
+                pass
+                # print(f"Client {self.server_port_no} error SENDING PS REQUEST to server {self.server_port_no}")
+                # print(f"ERROR {e}")
+
+            # RECEIVE POOL STATISTICS FROM SERVER
+            try:
+                received = s.recv(4096)
+                statistics = _pickle.loads(received)
+                for miner_id, miner in statistics.items():
+                    print(f"Miner {miner_id}: {miner['hash_rate']:.0f} hashes/s, {miner['shares']} shares")
+            except socket.error as e:
+                pass
+                # print(f"Client {self.server_port_no} error RECEIVING POOL STATISTICS from server {self.server_port_no}")
+                # print(f"ERROR {e}")
+
     def close_connection(self):
         """
         Sends "cc" to the server and kill itself
@@ -1,125 +1,146 @@
 import _pickle
 import socket
+import sys
 import threading
 import time
 
+from PoolCoordinator import SHARE_SAMPLE_SIZE
 from lib import calculate_hash
 
 HOST = "127.0.0.1"
 
 
 class Worker(threading.Thread):
-    def __init__(self, proof_to_work_on, server_port_no):
+    def __init__(self, miner):
         super().__init__()
-        self.working_on_proof = proof_to_work_on
-        self.server_port_no = server_port_no
-        self.running = False
+        self.miner = miner
+        self.work = None  # work assigned by the server (see PoolCoordinator.get_work), None if there's nothing to mine
+        self.finished_work = None  # last work the worker went through
 
     def run(self):
-        while True:
-            if not self.running:  # if worker is paused, do nothing
+        while self.miner.alive:
+            work = self.work
+            if work is None or work is self.finished_work:  # if worker has no new work, do nothing
+                time.sleep(0.01)
+                continue
+            share_count, shares, proof = self.mine(work)
+            self.finished_work = work
+            try:
+                # submitted even without shares, so that the server stops assigning this range to the miner
+                self.miner.submit(work, share_count, shares, proof)
+            except socket.error as e:
+                # print(f"Miner error SENDING SHARES to server {self.miner.server_port_no}")
+                # print(f"ERROR {e}")
                 continue
-            next_proof = 0
-            # if worker is running (i.e. has to find the next_proof for the server)
-            # keep trying finding the next_proof
-            # the while loop is blocked from the miner if it gets notified from the server that the proof the worker is working has already been found
-            while self.running and calculate_hash(next_proof ** 2 - self.working_on_proof ** 2)[:2] != "00":
-                next_proof += 1
-            if self.running:  # if you went out of the loop because you found the proof of work (and not because you've been paused)
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((HOST, int(self.server_port_no)))
-                    message = f"up|{next_proof}"
-
-                    # SEND NEW PROOF TO SERVER
-                    try:
-                        if self.running:  # if at this point you're still running, you can send the next_proof back to the server
-                            s.sendall(bytes(message, encoding="utf-8"))
-                            self.pause()  # pause myself and wait for the miner to activate me at the next "gp"
-                            received = s.recv(4096)
-                            print(received.decode("utf-8"))
-                    except socket.error as e:
-                        # print(f"Miner error SENDING PROOF to server {self.server_port_no}")
-                        # print(f"ERROR {e}")
-                        continue
-
-    def pause(self):
-        self.running = False
-
-    def activate(self):
-        self.running = True
+            if self.work is work:  # if the whole range has been searched, ask for the next one without waiting the poll
+                try:
+                    self.miner.request_work()
+                except socket.error as e:
+                    continue
+
+    def mine(self, work):
+        """
+        Searches the range of nonces in work for shares and for the next proof
+        The search stops as soon as the next proof is found or the miner replaces the work (i.e. the work got cancelled)
+        :param work: dictionary with the work assigned by the server
+        :return: tuple (number of shares found, list of the first SHARE_SAMPLE_SIZE shares, next proof or -1 if not found)
+        """
+        share_count = 0
+        shares = list()
+        nonce = work["start"]
+        while self.work is work and nonce < work["end"]:
+            digest = calculate_hash(nonce ** 2 - work["prev_proof"] ** 2)
+            if digest.startswith(work["share_difficulty"]):
+                share_count += 1
+                if len(shares) < SHARE_SAMPLE_SIZE:  # the other shares are only counted, keeps the message small
+                    shares.append(nonce)
+                if digest.startswith(work["proof_difficulty"]):
+                    return share_count, shares, nonce
+            nonce += 1
+        return share_count, shares, -1
 
 
 class BlockchainMiner(threading.Thread):
-    def __init__(self, server_port_no):
+    def __init__(self, server_port_no, server_host=HOST):
         super().__init__()
         self.server_port_no = server_port_no
-        self.prev_proof = 100  # genesis block proof
-        self.worker_thread = Worker(self.prev_proof, self.server_port_no)
+        self.server_host = server_host  # miners can be attached to a server role on another host
+        self.miner_id = None  # id assigned by the server's pool at registration
+        self.work_lock = threading.Lock()  # work is requested both by the poll_server thread and by the worker
+        self.worker_thread = Worker(self)
         self.alive = True
 
     def run(self):
-        self.worker_thread.start()  # will not work on a new proof at the start, will start working for the first time after the first "gp" signal
+        self.worker_thread.start()  # will not work on a new proof at the start, will start working for the first time after the first "gw"
         poll_server_thread = threading.Thread(target=self.poll_server)
         poll_server_thread.start()
 
+    def send(self, message):
+        """
+        Sends message to the server and returns its response
+        """
+        with socket.create_connection((self.server_host, int(self.server_port_no)), timeout=5) as s:
+            s.sendall(bytes(message, encoding="utf-8"))
+            return s.recv(4096)
+
     def poll_server(self):
         dead_server_counter = 0  # will keep the number of times the miner cannot connect to its server role
         while self.alive:
             time.sleep(1)
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                # CONNECT TO SERVER
-                try:
-                    s.connect((HOST, int(self.server_port_no)))
-                except socket.error as e:
-                    dead_server_counter += 1
-                    if dead_server_counter > 2:
-                        # if miner cannot connect to server for 3 times, than it kills itself
-                        self.alive = False
-                        self.worker_thread.pause()
-                        exit()
-                        raise SystemExit(0)
-                    # print(f"Miner {self.port_no} error CONNECTING with server {self.server_port_no}")
-                    # print(f"ERROR {e}")
-                    continue
-
-                # REQUEST CURRENT PROOF OWNED BY SERVER
-                try:
-                    message = "gp"  # message is "get proof" request command to send to the server
-                    s.sendall(bytes(message, encoding="utf-8"))
-
-                except socket.error as e:
-                    # print(f"Miner {self.server_port_no} error SENDING REQUEST to server {self.server_port_no}")
-                    # print(f"ERROR {e}")
-                    continue
-
-                # RECEIVE PROOF FROM SERVER
-                try:
-                    received = s.recv(4096)
-                    proofs_dictionary = _pickle.loads(received)
-
-                    # The package received from the server is in the format { "prev_proof": int, "next_proof": int (-1 if server needs a next proof)}
-                    # CASES:
-                    # A) prev_proof is the same as worker_thread.working_on_proof
-                    # B) prev_proof is different from worker_thread.working_on_proof -> Happens if the server receives a block which has the proof the worker is working on
-                    # C) next_proof is a positive integer -> Server has the next proof already
-                    # D) next_proof is -1, server needs the next proof
-
-                    if proofs_dictionary["next_proof"] >= 0:  # if C
-                        self.worker_thread.pause()  # pause the worker because there's no need to compute the next proof
-                        self.worker_thread.working_on_proof = proofs_dictionary["prev_proof"]
-                    elif proofs_dictionary["next_proof"] == -1:  # if D
-                        # print(f"starting on working on a new proof. {proofs_dictionary}")
-                        # and the prev_proof if different from the one the worker is working on, make the worker work for the next proof
-                        if proofs_dictionary["prev_proof"] != self.worker_thread.working_on_proof:
-                            self.worker_thread.pause()  # pause worker
-                            self.worker_thread.working_on_proof = proofs_dictionary[
-                                "prev_proof"]  # change proof to work on
-                            self.worker_thread.activate()  # reactivate worker
-                        # if next_proof is -1 and prev_proof is equal to the one the worker is working on, do nothing and let the worker work
-                        # at the first poll_server run this is the branch that will be selected and that will activate the Worker for the first time
-                        else:
-                            self.worker_thread.activate()
-                except socket.error as e:
-                    # print(f"Miner {self.server_port_no} error RECEIVING PROOF to server {self.server_port_no}")
-                    # print(f"ERROR {e}")
-                    continue
+            try:
+                self.request_work()
+            except socket.error as e:
+                dead_server_counter += 1
+                if dead_server_counter > 2:
+                    # if miner cannot connect to server for 3 times, than it kills itself
+                    self.alive = False
+                    self.worker_thread.work = None
+                    exit()
+                    raise SystemExit(0)
+                # print(f"Miner error CONNECTING with server {self.server_port_no}")
+                # print(f"ERROR {e}")
+                continue
+            except _pickle.UnpicklingError:
+                continue
+            dead_server_counter = 0
+
+    def request_work(self):
+        """
+        Asks the server the work to do ("gw" command, registering with "mr" first if needed) and hands it to the worker
+        CASES:
+        A) the server does not need a proof -> the worker stops
+        B) the server sends the range the worker is already searching -> nothing changes
+        C) the server sends a new range (because the worker finished the previous one or the job changed) -> the
+        worker stops searching the previous range and starts on the new one
+        """
+        with self.work_lock:
+            if self.miner_id is None:
+                self.miner_id = _pickle.loads(self.send("mr"))["miner_id"]
+            work = _pickle.loads(self.send(f"gw|{self.miner_id}"))
+            if work is None:  # server does not know this miner (e.g. it has been dropped), register at the next request
+                self.miner_id = None
+                return
+
+            current_work = self.worker_thread.work
+            if work["start"] is None:  # if A
+                self.worker_thread.work = None
+            elif current_work is None or current_work is self.worker_thread.finished_work or \
+                    (work["job_id"], work["start"]) != (current_work["job_id"], current_work["start"]):  # if C
+                self.worker_thread.work = work
+
+    def submit(self, work, share_count, shares, proof):
+        """
+        Sends the number of shares found in the range of work, a sample of them and the next proof (-1 if not found)
+        to the server ("sh" command)
+        """
+        message = f"sh|{self.miner_id}|{work['job_id']}|{proof}|{share_count}|{','.join(str(share) for share in shares)}"
+        received = self.send(message)
+        if proof >= 0:
+            print(received.decode("utf-8"))
+
+
+if __name__ == "__main__":
+    # a miner can also be run on its own and attached to the server role of a peer:
+    # python3 BlockchainMiner.py <Server-host> <Server-port-no>
+    miner = BlockchainMiner(int(sys.argv[2]), sys.argv[1])
+    miner.start()
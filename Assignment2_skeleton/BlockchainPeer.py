@@ -1,10 +1,12 @@
-import time
 from BlockchainMiner import BlockchainMiner
 from BlockchainServer import BlockchainServer
 from BlockchainClient import BlockchainClient
+from PeerManager import PeerManager
+import re
 import sys
 
 GENESIS_BLOCK_PROOF = 100
+CHECKPOINT_HASH_PATTERN = re.compile("[0-9a-f]{64}")
 
 
 class BlockchainPeer:
@@ -13,8 +15,13 @@ class BlockchainPeer:
         self.node_id = sys.argv[1]
         self.port_no = int(sys.argv[2])
         self.config_fp = sys.argv[3]
-        self.port_dict = {}
-        self.node_timeouts = {}
+        # optional checkpoint to bootstrap from, either the path of a checkpoint file or the hash of a checkpoint
+        # announced by the neighbours
+        checkpoint = sys.argv[4] if len(sys.argv) > 4 else None
+        is_hash = checkpoint is not None and CHECKPOINT_HASH_PATTERN.fullmatch(checkpoint) is not None
+        self.checkpoint_fp = checkpoint if not is_hash else None
+        self.checkpoint_hash = checkpoint if is_hash else None
+        self.peer_manager = PeerManager()
 
         f = open(self.config_fp, 'r')
         self.num_adj_nodes = int(f.readline())
@@ -22,14 +29,13 @@ class BlockchainPeer:
         for i in range(self.num_adj_nodes):
             _input = f.readline()
             _input = _input.split()
-            self.port_dict[_input[0]] = int(_input[1])
-            self.node_timeouts.update({_input[0]: {'ping': time.time(), 'state': True}})
+            self.peer_manager.add_peer(_input[0], int(_input[1]))
 
     def run(self):
-        blockchain_server_thread = BlockchainServer(self.node_id, self.port_no, self.node_timeouts,
-                                                    self.port_dict, GENESIS_BLOCK_PROOF)
+        blockchain_server_thread = BlockchainServer(self.node_id, self.port_no, self.peer_manager, GENESIS_BLOCK_PROOF,
+                                                    self.checkpoint_fp, self.checkpoint_hash)
         blockchain_miner_thread = BlockchainMiner(self.port_no)
-        blockchain_client_thread = BlockchainClient(self.port_no, self.port_dict)
+        blockchain_client_thread = BlockchainClient(self.port_no, self.peer_manager)
         blockchain_server_thread.start()
         blockchain_miner_thread.start()
         blockchain_client_thread.start()
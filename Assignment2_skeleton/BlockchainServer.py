@@ -2,13 +2,24 @@ from multiprocessing import Lock
 import threading
 import socket
 import _pickle
+from Block import Block
 from Blockchain import Blockchain
 from Transaction import Transaction
 import time
-from Block import Block
-from lib import calculate_hash
+from lib import calculate_hash, receive_all, load_received, MalformedDataError
+from PeerManager import PeerManager, PEER_ERRORS
+from Checkpoint import Checkpoint
+from Ledger import Ledger
+from BlockTemplate import BlockTemplate, BLOCK_SIZE
+from PoolCoordinator import PoolCoordinator, PROOF_DIFFICULTY
+from CompactBlock import CompactBlock, short_id, encode_short_ids, decode_short_ids
 
 HOST = "127.0.0.1"
+HEARTBEAT_ROUND_TIMEOUT = 4  # seconds after which a heartbeat round stops waiting for slow peers (rounds start every 5 seconds)
+CHECKPOINT_INTERVAL = 10  # number of blocks between two checkpoints
+BOOTSTRAP_TIMEOUT = 5  # seconds a neighbour has for sending its checkpoint or blocks to a bootstrapping peer
+CHECKPOINT_QUORUM = 2  # neighbours that have to announce the same checkpoint for a bootstrapping peer to trust it
+MAX_MISSING_TRANSACTIONS = 100  # over this number of unknown transactions, the whole blockchain is requested instead
 
 
 class Heartbeat(threading.Thread):
@@ -19,39 +30,108 @@ class Heartbeat(threading.Thread):
 
     def run(self):
         """
-        The Heartbeat thread will keep sending the "hb" command to all the peers every 5 seconds
-        Each blockchain received from the peers as response to "hb" is compared with the one owned by the server
-        that resides in the peer sending the "hb". The blockchain will be eventually updated with the incoming one if
-        longer and valid.
+        The Heartbeat thread will keep sending the "hh" command to all the reachable peers every 5 seconds
+        If a peer responds with a blockchain longer than ours, the exceeding blocks are requested as compact blocks and
+        rebuilt from the transactions in our pool. If this is not possible (e.g. the blockchains have forked), the
+        whole blockchain is requested with the "hb" command and compared with the one owned by the server that resides
+        in the peer sending the "hb". The blockchain will be eventually updated with the incoming one if longer and valid.
+        Peers are contacted in parallel and every socket operation has a timeout, so that a slow or dead peer does not
+        delay the heartbeat to the others. Peers that do not answer are retried with exponential backoff.
         """
         while self.server.alive:
             time.sleep(5)
-            for peer_id, destination_port in self.server.port_dict.items():
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    # SEND HEARTBEAT
-                    heartbeat = "hb"
-                    try:
-                        s.connect((HOST, int(destination_port)))
-                        s.sendall(bytes(heartbeat, encoding="utf-8"))
-                    except socket.error as e:
-                        continue
-                        # print(f"Server {self.server.port_no} error SENDING HEARTBEAT to {peer_id}")
-                        # print(f"ERROR {e}")
-
-                    # LISTEN FOR PEER'S BLOCKCHAIN JSON
-                    try:
-                        received = s.recv(4096)
-                        received_blockchain_json = received
-                    except socket.error as e:
-                        # print(f"Server {self.server.port_no} error RECEIVING BLOCKCHAIN JSON in HB from {destination_port}")
-                        # print(f"ERROR {e}")
-                        continue
-
-                    if received_blockchain_json:
-                        # Synchronize access to blockchain (server might modify the blockchain at the same time)
-                        self.blockchain_lock.acquire()
-                        self.compare_blockchains(received_blockchain_json)
-                        self.blockchain_lock.release()
+            self.server.peer_manager.run_on_peers(self.send_heartbeat, timeout=HEARTBEAT_ROUND_TIMEOUT)
+
+    def send_heartbeat(self, peer_id, destination_port):
+        """
+        Sends the "hh" command to a single peer and syncs our blockchain with the peer's one if longer
+        :return: True if the peer answered, False otherwise
+        :raise MalformedDataError: if the peer answered with something we cannot read (counted as a failure)
+        """
+        with self.server.peer_manager.connect(destination_port) as s:
+            # SEND HEARTBEAT
+            heartbeat = "hh"
+            s.sendall(bytes(heartbeat, encoding="utf-8"))
+
+            # LISTEN FOR PEER'S BLOCKCHAIN LENGTH
+            received = s.recv(4096)
+
+        if not received:
+            return False
+
+        payload = load_received(received, dict)
+        if not isinstance(payload.get("length"), int):
+            raise MalformedDataError("malformed blockchain length")
+        if payload["length"] > len(self.server.Blockchain.blockchain):
+            if not self.compact_sync(destination_port):
+                self.full_sync(destination_port)
+        return True
+
+    def request(self, destination_port, message):
+        """
+        Sends message to a peer and returns its (pickled) response, the peer has to close the connection after responding
+        :return: the response, a dictionary
+        :raise MalformedDataError: if the response is not a pickled dictionary
+        """
+        with self.server.peer_manager.connect(destination_port) as s:
+            s.sendall(bytes(message, encoding="utf-8"))
+            return load_received(receive_all(s), dict)
+
+    def compact_sync(self, destination_port):
+        """
+        Requests the blocks exceeding our blockchain as compact blocks ("cb" command), rebuilds them from the
+        transactions we know and requests only the missing transactions ("gt" command)
+        :return: True if the blocks have been added to our blockchain, False otherwise
+        """
+        length = len(self.server.Blockchain.blockchain)
+        previous_hash = self.server.Blockchain.get_previous_block_hash()
+        payload = self.request(destination_port, f"cb|{length}")
+        if not isinstance(payload.get("blocks"), list):
+            raise MalformedDataError("malformed compact blocks")
+        compact_blocks = [CompactBlock.decode(data) for data in payload["blocks"]]
+        pool_ids = decode_short_ids(payload.get("transaction_pool"))
+        known_transactions = {short_id(transaction): transaction
+                              for transaction in self.server.Blockchain.peek_transactions(None)}
+        needed_ids = [transaction_id for compact_block in compact_blocks for transaction_id in compact_block.short_ids]
+        needed_ids += pool_ids
+        missing_ids = [transaction_id for transaction_id in needed_ids if transaction_id not in known_transactions]
+        if len(missing_ids) > MAX_MISSING_TRANSACTIONS:
+            return False  # it is cheaper to get the whole blockchain
+        if missing_ids:
+            received_transactions = self.request(destination_port, f"gt|{length}|{','.join(missing_ids)}")
+            if not all(isinstance(transaction_id, str) and Transaction.is_well_formed(transaction)
+                       for transaction_id, transaction in received_transactions.items()):
+                raise MalformedDataError("malformed transactions")
+            known_transactions.update(received_transactions)
+
+        blocks = list()
+        for compact_block in compact_blocks:
+            block = compact_block.to_block(previous_hash, known_transactions)
+            if block is None:
+                return False
+            blocks.append(block)
+            previous_hash = block.current_hash
+        if any(transaction_id not in known_transactions for transaction_id in pool_ids):
+            return False
+        transaction_pool = [known_transactions[transaction_id] for transaction_id in pool_ids]
+        return self.server.add_synced_blocks(blocks, transaction_pool)
+
+    def full_sync(self, destination_port):
+        """
+        Requests the whole blockchain of a peer ("hb" command) and compares it with ours
+        """
+        with self.server.peer_manager.connect(destination_port) as s:
+            s.sendall(bytes("hb", encoding="utf-8"))
+            received_blockchain_json = receive_all(s)
+
+        if received_blockchain_json:
+            # Synchronize access to blockchain (server might modify the blockchain at the same time)
+            self.blockchain_lock.acquire()
+            try:
+                self.compare_blockchains(received_blockchain_json)
+            finally:
+                self.blockchain_lock.release()
+            self.server.export_checkpoint()
 
     def compare_blockchains(self, other_blockchain_json):
         """
@@ -60,14 +140,16 @@ class Heartbeat(threading.Thread):
         2) If the length is greater, it checks if all the exceeding blocks are valid (valid transactions inside)
         3) If so, it will update the blockchain with the new, longer one
         :param other_blockchain_json: received json from server after hb
+        :raise MalformedDataError: if the peer did not send a well formed Blockchain object
         """
-        other_blockchain = _pickle.loads(other_blockchain_json)
-        if isinstance(other_blockchain,
-                      Blockchain):  # if the thing the peer sent me is actually a Blockchain object, then I can comapre it
-            if len(other_blockchain.blockchain) > len(self.server.Blockchain.blockchain):  # check chains lengths
-                exceeding_blocks = self.get_exceeding_blocks(other_blockchain)
-                if self.valid_exceeding_blocks(exceeding_blocks):
-                    self.update_blockchain(other_blockchain)  # keep the longest chain
+        other_blockchain = load_received(other_blockchain_json, Blockchain)
+        # the thing the peer sent me has to be actually a Blockchain object to compare it
+        if not Blockchain.is_well_formed(other_blockchain):
+            raise MalformedDataError("malformed blockchain")
+        if len(other_blockchain.blockchain) > len(self.server.Blockchain.blockchain):  # check chains lengths
+            exceeding_blocks = self.get_exceeding_blocks(other_blockchain)
+            if self.valid_exceeding_blocks(exceeding_blocks):
+                self.update_blockchain(other_blockchain)  # keep the longest chain
 
     def get_exceeding_blocks(self, other_blockchain: Blockchain):
         """
@@ -100,20 +182,46 @@ class Heartbeat(threading.Thread):
         self.server.Blockchain = new_blockchain
         self.server.prev_proof = self.server.Blockchain.get_previous_proof()
         self.server.next_proof = -1
+        if self.server.incremental_ledger_sync:
+            # only the blocks after the last common block are (un)applied
+            self.server.ledger.sync(new_blockchain.blockchain)
+        else:
+            ledger = Ledger()
+            ledger.sync(new_blockchain.blockchain)
+            self.server.ledger = ledger
+        self.server.update_checkpoint()  # exported by full_sync once the lock is released
+        self.server.update_block_template()
 
 
 class BlockchainServer(threading.Thread):
-    def __init__(self, node_id: str, port_no: int, node_timeouts, port_dict, genesis_block_proof: int):
+    def __init__(self, node_id: str, port_no: int, peer_manager: PeerManager, genesis_block_proof: int,
+                 checkpoint_fp=None, checkpoint_hash=None):
         super().__init__()
         self.node_id = node_id
         self.port_no = port_no
-        self.node_timeouts = node_timeouts
-        self.port_dict = port_dict
+        self.peer_manager = peer_manager  # neighbours of the peer with their health
         self.Blockchain = Blockchain()
+        self.ledger = Ledger()  # state derived from the transactions in the blockchain
+        self.ledger.apply_block(self.Blockchain.get_previous_block())  # genesis block
+        self.incremental_ledger_sync = Ledger.check_sync()  # False if rolling back blocks does not restore the state
+        if not self.incremental_ledger_sync:
+            print(f"Server {self.port_no} ledger rollbacks do not restore the state, the ledger will be rebuilt")
         self.next_proof = -1
         self.prev_proof = genesis_block_proof
+        self.block_template = None  # BlockTemplate of the next block, kept up to date as transactions arrive
+        self.seal_block_templates = BlockTemplate.check_seal()  # False if seal does not hash blocks as Block does
+        if not self.seal_block_templates:
+            print(f"Server {self.port_no} block templates do not match Block.calculate_hash, blocks will be hashed whole")
+        self.mining_pool = PoolCoordinator()  # splits the search of the next proof among the attached miners
         self.blockchain_lock = Lock()
         self.alive = True
+        self.checkpoint_fp = checkpoint_fp  # optional file of a checkpoint to bootstrap from
+        self.trusted_checkpoint_hash = checkpoint_hash  # optional hash of a neighbours' checkpoint to bootstrap from
+        self.checkpoint = None  # last Checkpoint created or bootstrapped from
+        self.checkpoint_index = 1  # index of the last block in the last snapshot taken for a checkpoint
+        self.checkpoint_snapshot = None  # (blocks, transaction pool) taken for the next checkpoint, not exported yet
+        self.checkpoint_lock = threading.Lock()  # checkpoints are exported outside of the blockchain lock
+        self.checkpoint_json = _pickle.dumps(None)  # self.checkpoint already serialized, ready to be served to other peers
 
     def run(self):
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -121,7 +229,11 @@ class BlockchainServer(threading.Thread):
         self.heartbeat_thread = Heartbeat(self, self.blockchain_lock)
         start_wss_thread = threading.Thread(target=self.start_wss)
         start_wss_thread.start()
+        self.bootstrap()
         self.heartbeat_thread.start()
+        # ANNOUNCE THIS PEER TO THE NEIGHBOURS (they will add it to their peers if they don't know it yet)
+        announce_thread = threading.Thread(target=self.peer_manager.broadcast, args=(f"jn|{self.node_id}|{self.port_no}",))
+        announce_thread.start()
 
     def start_wss(self):
         # The server role keeps listening for incoming commands until it is alive
@@ -137,17 +249,59 @@ class BlockchainServer(threading.Thread):
                     case "up":
                         update_proof_thread = threading.Thread(target=self.update_proof, args=(msg, conn))
                         update_proof_thread.start()
+                    case "mr":
+                        register_miner_thread = threading.Thread(target=self.register_miner, args=(msg, conn))
+                        register_miner_thread.start()
+                    case "gw":
+                        get_work_thread = threading.Thread(target=self.get_work, args=(msg, conn))
+                        get_work_thread.start()
+                    case "sh":
+                        submit_shares_thread = threading.Thread(target=self.submit_shares, args=(msg, conn))
+                        submit_shares_thread.start()
+                    case "ps":
+                        pool_statistics_thread = threading.Thread(target=self.pool_statistics, args=(msg, conn))
+                        pool_statistics_thread.start()
                     case "tx":
                         update_transaction_thread = threading.Thread(target=self.update_transaction, args=(msg, conn))
                         update_transaction_thread.start()
+                    case "hh":
+                        return_length_thread = threading.Thread(target=self.return_length, args=(msg, conn))
+                        return_length_thread.start()
+                    case "cb":
+                        return_compact_blocks_thread = threading.Thread(target=self.return_compact_blocks,
+                                                                        args=(msg, conn))
+                        return_compact_blocks_thread.start()
+                    case "gt":
+                        return_transactions_thread = threading.Thread(target=self.return_transactions, args=(msg, conn))
+                        return_transactions_thread.start()
                     case "hb":
                         return_heartbeat_thread = threading.Thread(target=self.return_heartbeat, args=(msg, conn))
                         return_heartbeat_thread.start()
                     case "pb":
                         print_blockchain_thread = threading.Thread(target=self.print_blockchain, args=(msg, conn))
                         print_blockchain_thread.start()
+                    case "lq":
+                        ledger_query_thread = threading.Thread(target=self.ledger_query, args=(msg, conn))
+                        ledger_query_thread.start()
+                    case "ck":
+                        return_checkpoint_thread = threading.Thread(target=self.return_checkpoint, args=(msg, conn))
+                        return_checkpoint_thread.start()
+                    case "gc":
+                        return_checkpoint_content_thread = threading.Thread(target=self.return_checkpoint_content,
+                                                                            args=(msg, conn))
+                        return_checkpoint_content_thread.start()
+                    case "gb":
+                        return_blocks_thread = threading.Thread(target=self.return_blocks, args=(msg, conn))
+                        return_blocks_thread.start()
+                    case "jn":
+                        join_thread = threading.Thread(target=self.join_peer, args=(msg, conn))
+                        join_thread.start()
+                    case "lv":
+                        leave_thread = threading.Thread(target=self.leave_peer, args=(msg, conn))
+                        leave_thread.start()
                     case "cc":
-                        # terminates the server
+                        # tell the neighbours that this peer is leaving, then terminates the server
+                        self.peer_manager.broadcast(f"lv|{self.node_id}")
                         self.server.close()
                         self.alive = False
                         exit()
@@ -171,20 +325,84 @@ class BlockchainServer(threading.Thread):
         :param conn: miner's socket
         """
         proof = int(msg[3:])
+        if self.accept_proof(proof):
+            conn.sendall(b"Reward")
+        else:
+            conn.sendall(b"No Reward")
 
+    def accept_proof(self, proof, job_prev_proof=None):
+        """
+        Checks if the next_proof found by a miner is valid and if so uses it for the next block
+        Only the first valid proof for a prev_proof is accepted, the ones found later by other miners are not rewarded
+        :param proof: integer, the next proof
+        :param job_prev_proof: optional prev_proof the miner searched the proof for, it has to be the current one
+        :return: True if the proof is accepted, False otherwise
+        """
+        self.blockchain_lock.acquire()
         # validate proof is correct
         # print(f"prev proof from server is: {self.prev_proof}")
-        if calculate_hash(proof ** 2 - self.prev_proof ** 2)[:2] == "00":
-            conn.sendall(b"Reward")
+        accepted = self.next_proof == -1 and (job_prev_proof is None or job_prev_proof == self.prev_proof) and \
+            calculate_hash(proof ** 2 - self.prev_proof ** 2)[:2] == PROOF_DIFFICULTY
+        if accepted:
             self.next_proof = proof
+        self.blockchain_lock.release()
+        if accepted:
             self.create_block()
+        return accepted
+
+    def register_miner(self, msg, conn):
+        """
+        Registers a new miner in the pool and sends back its id as { "miner_id": int }
+        """
+        conn.sendall(_pickle.dumps({"miner_id": self.mining_pool.register_miner()}))
+        conn.close()
+
+    def get_work(self, msg, conn):
+        """
+        Sends back to the miner in the "gw|{miner_id}" command its work (see PoolCoordinator.get_work), None if the
+        miner has to register again
+        """
+        msg = msg.split("|")
+        work = None
+        if len(msg) == 2 and msg[1].isdigit():
+            work = self.mining_pool.get_work(int(msg[1]), self.prev_proof, self.next_proof == -1)
+        conn.sendall(_pickle.dumps(work))
+        conn.close()
+
+    def submit_shares(self, msg, conn):
+        """
+        Accounts the shares in the "sh|{miner_id}|{job_id}|{proof}|{share_count}|{share},{share},..." command and, if
+        proof is not -1, checks it and rewards the miner as for "up"
+        """
+        msg = msg.split("|")
+        try:
+            miner_id, job_id, proof, share_count = int(msg[1]), int(msg[2]), int(msg[3]), int(msg[4])
+            shares = [int(share) for share in msg[5].split(",") if share]
+        except (IndexError, ValueError):
+            conn.sendall(b"Rejected")
+            conn.close()
+            return
+        job_prev_proof = self.mining_pool.get_job_prev_proof(job_id)
+        accepted_shares = self.mining_pool.submit(miner_id, job_id, share_count, shares)
+        if proof >= 0 and job_prev_proof is not None and self.accept_proof(proof, job_prev_proof):
+            conn.sendall(b"Reward")
+        elif accepted_shares is None:
+            conn.sendall(b"Stale")
         else:
-            conn.sendall(b"No Reward")
+            conn.sendall(bytes(f"Shares accepted: {accepted_shares}", encoding="utf-8"))
+        conn.close()
+
+    def pool_statistics(self, msg, conn):
+        """
+        Sends back to client the statistics of the miners in the pool (see PoolCoordinator.get_statistics)
+        """
+        conn.sendall(_pickle.dumps(self.mining_pool.get_statistics()))
+        conn.close()
 
     def update_transaction(self, msg, conn):
         """
         Validates transaction sent by the client and adds it to the Blockchain pool
-        If the transaction pool contains 5 or more transactions and we already have a next_proof, a new block is created and added to the blockchain
+        If the transaction pool contains BLOCK_SIZE or more transactions and we already have a next_proof, a new block is created and added to the blockchain
         """
         print(f"Server {self.port_no} is validating transaction")
         try:
@@ -193,11 +411,21 @@ class BlockchainServer(threading.Thread):
                 # create transaction object from msg
                 transaction = Transaction(msg[1], msg[2])
                 try:
-                    if transaction.validate():
+                    # transfers are validated against the confirmed state and the transfers already in the pool, under
+                    # the lock so that two copies of the same transfer cannot both be accepted
+                    self.blockchain_lock.acquire()
+                    try:
+                        accepted = transaction.validate() and \
+                            self.ledger.validate_transfer(msg[1], msg[2], self.Blockchain.peek_transactions(None))
+                        if accepted:
+                            self.Blockchain.add_transaction(transaction)
+                    finally:
+                        self.blockchain_lock.release()
+                    if accepted:
                         # send back to client that the transaction has been accepted
                         conn.sendall(b"Accepted")
-                        self.Blockchain.add_transaction(transaction)
-                        if self.Blockchain.pool_length() >= 5:
+                        self.update_block_template()
+                        if self.Blockchain.pool_length() >= BLOCK_SIZE:
                             self.create_block()
                     else:
                         # send back to client that the transaction has been rejected
@@ -219,6 +447,121 @@ class BlockchainServer(threading.Thread):
         """
         blockchain_json = _pickle.dumps(self.Blockchain)
         conn.sendall(blockchain_json)
+        conn.close()
+
+    def return_length(self, msg, conn):
+        """
+        Sends back the length of the blockchain as { "length": int } to the peer which has requested it with an "hh"
+        command
+        """
+        conn.sendall(_pickle.dumps({"length": len(self.Blockchain.blockchain)}))
+
+    def return_compact_blocks(self, msg, conn):
+        """
+        Sends back the blocks following the index in the "cb|{index}" command as encoded compact blocks and the short
+        ids of the transactions in the pool, as { "blocks": list(tuple), "transaction_pool": bytes }
+        """
+        msg = msg.split("|")
+        if len(msg) == 2 and msg[1].isdigit():
+            self.blockchain_lock.acquire()
+            payload = {
+                "blocks": [CompactBlock.from_block(block).encode() for block in self.Blockchain.blockchain
+                           if block.index > int(msg[1])],
+                "transaction_pool": encode_short_ids([short_id(transaction)
+                                                      for transaction in self.Blockchain.peek_transactions(None)])
+            }
+            self.blockchain_lock.release()
+            conn.sendall(_pickle.dumps(payload))
+        conn.close()
+
+    def return_transactions(self, msg, conn):
+        """
+        Sends back the transactions with the short ids in the "gt|{index}|{short_id},{short_id},..." command, looking
+        for them in the blocks following index and in the pool, as a dictionary short id -> transaction
+        """
+        msg = msg.split("|")
+        if len(msg) == 3 and msg[1].isdigit():
+            requested_ids = set(msg[2].split(","))
+            self.blockchain_lock.acquire()
+            transactions = self.Blockchain.peek_transactions(None)
+            for block in self.Blockchain.blockchain:
+                if block.index > int(msg[1]):
+                    transactions += block.transactions
+            self.blockchain_lock.release()
+            payload = {short_id(transaction): transaction for transaction in transactions
+                       if short_id(transaction) in requested_ids}
+            conn.sendall(_pickle.dumps(payload))
+        conn.close()
+
+    def ledger_query(self, msg, conn):
+        """
+        Sends back to client the state of the sender in the "lq|{sender}" command as
+        { "transactions": int, "balance": int, "nonce": int }
+        """
+        sender = msg[3:]
+        payload = {
+            "transactions": self.ledger.get_transaction_count(sender),
+            "balance": self.ledger.get_balance(sender),
+            "nonce": self.ledger.get_nonce(sender)
+        }
+        conn.sendall(_pickle.dumps(payload))
+
+    def return_checkpoint(self, msg, conn):
+        """
+        Sends back the index and the hash of the last checkpoint as (int, str), None if no checkpoint has been created
+        yet, to the peer which has requested them with a "ck" command. The content of the checkpoint is sent with "gc"
+        """
+        with self.checkpoint_lock:
+            checkpoint = self.checkpoint
+        conn.sendall(_pickle.dumps((checkpoint.index, checkpoint.checkpoint_hash) if checkpoint is not None else None))
+        conn.close()
+
+    def return_checkpoint_content(self, msg, conn):
+        """
+        Sends back the last checkpoint to the peer which has requested it with a "gc|{checkpoint_hash}" command, None
+        if the hash is not the one of the last checkpoint (e.g. a new checkpoint has been created in the meantime)
+        """
+        with self.checkpoint_lock:
+            checkpoint, checkpoint_json = self.checkpoint, self.checkpoint_json
+        if checkpoint is not None and msg[3:] == checkpoint.checkpoint_hash:
+            conn.sendall(checkpoint_json)
+        else:
+            conn.sendall(_pickle.dumps(None))
+        conn.close()
+
+    def return_blocks(self, msg, conn):
+        """
+        Sends back the blocks following the index in the "gb|{index}" command and the transaction pool, as
+        { "blocks": list(Block), "transaction_pool": list(str) }
+        """
+        msg = msg.split("|")
+        if len(msg) == 2 and msg[1].isdigit():
+            self.blockchain_lock.acquire()
+            payload = {
+                "blocks": [block for block in self.Blockchain.blockchain if block.index > int(msg[1])],
+                "transaction_pool": [transaction.get_as_string() for transaction in self.Blockchain.transaction_pool]
+            }
+            self.blockchain_lock.release()
+            conn.sendall(_pickle.dumps(payload))
+        conn.close()
+
+    def join_peer(self, msg, conn):
+        """
+        Adds the peer that sent the "jn|{peer_id}|{port}" command to the neighbours
+        """
+        msg = msg.split("|")
+        if len(msg) == 3 and msg[2].isdigit() and msg[1] != self.node_id:
+            self.peer_manager.add_peer(msg[1], int(msg[2]))
+        conn.close()
+
+    def leave_peer(self, msg, conn):
+        """
+        Removes the peer that sent the "lv|{peer_id}" command from the neighbours
+        """
+        msg = msg.split("|")
+        if len(msg) == 2:
+            self.peer_manager.remove_peer(msg[1])
+        conn.close()
 
     def print_blockchain(self, msg, conn):
         """
@@ -233,14 +576,208 @@ class BlockchainServer(threading.Thread):
         """
         Creates a new block and adds it ot the blockchain
         """
-        # if the blockchain has at least 5 transactions in the pool and I have the next proof, create the block
-        if self.Blockchain.pool_length() >= 5 and self.next_proof > 0:
+        # if the blockchain has at least BLOCK_SIZE transactions in the pool and I have the next proof, create the block
+        if self.Blockchain.pool_length() >= BLOCK_SIZE and self.next_proof > 0:
             self.blockchain_lock.acquire()  # acquire the lock
-            transactions = self.Blockchain.get_five_transactions()  # take the first 5 transactions form the pool as strings
-            block = Block(self.Blockchain.get_previous_index() + 1, transactions, self.next_proof,
-                          self.Blockchain.get_previous_block_hash())  # instantiate new block
-            self.Blockchain.add_new_block(block)
+            # check again under the lock, the block might have been created by another thread in the meantime
+            if self.Blockchain.pool_length() >= BLOCK_SIZE and self.next_proof > 0:
+                # seal the template prepared while the proof was being mined, rebuild it only if the chain or pool
+                # changed since
+                template = self.block_template
+                if template is None or not template.matches(self.Blockchain):
+                    template = BlockTemplate.from_blockchain(self.Blockchain)
+                # first BLOCK_SIZE transactions of the pool with the next proof
+                block = template.seal(self.next_proof) if self.seal_block_templates else template.build(self.next_proof)
+                self.Blockchain.add_new_block(block)
+                self.ledger.apply_block(block)
+                # update proofs known by the server
+                self.prev_proof = self.next_proof
+                self.next_proof = -1  # server needs the next proof
+                self.update_checkpoint()
             self.blockchain_lock.release()  # release the lock
-            # update proofs known by the server
-            self.prev_proof = self.next_proof
-            self.next_proof = -1  # server needs the next proof
+            self.export_checkpoint()
+            self.update_block_template()
+
+    def update_block_template(self):
+        """
+        Prepares the template of the next block if the current one does not follow the blockchain or does not contain
+        the first transactions of the pool anymore
+        """
+        if self.block_template is None or not self.block_template.matches(self.Blockchain):
+            self.block_template = BlockTemplate.from_blockchain(self.Blockchain)
+
+    def update_checkpoint(self):
+        """
+        Takes a snapshot of the blockchain for a new checkpoint if the blockchain went past the block of the next
+        checkpoint. Checkpoints are taken every CHECKPOINT_INTERVAL blocks (at blocks 11, 21, ...) also when several
+        blocks are added at once, so that peers with the same chain have the same checkpoints. Has to be called while
+        holding the blockchain lock, and followed by export_checkpoint once the lock is released: only the references to
+        the blocks are copied here
+        """
+        last_index = self.Blockchain.get_previous_index()
+        checkpoint_index = last_index - (last_index - 1) % CHECKPOINT_INTERVAL
+        if checkpoint_index > self.checkpoint_index:
+            # the block with index i is at position i - 1 in the blockchain
+            self.checkpoint_snapshot = (self.Blockchain.blockchain[:checkpoint_index],
+                                        self.Blockchain.peek_transactions(None))
+            self.checkpoint_index = checkpoint_index
+
+    def export_checkpoint(self):
+        """
+        Creates the checkpoint from the snapshot taken by update_checkpoint (if any), serializes it for the other peers
+        and exports it to file. Has to be called without holding the blockchain lock
+        """
+        with self.checkpoint_lock:
+            snapshot = self.checkpoint_snapshot
+            self.checkpoint_snapshot = None
+            if snapshot is None:
+                return
+            checkpoint = Checkpoint(*snapshot)
+            if self.checkpoint is not None and checkpoint.index <= self.checkpoint.index:
+                return
+            self.checkpoint_json = _pickle.dumps(checkpoint)
+            self.checkpoint = checkpoint
+            try:
+                checkpoint.export(f"checkpoint_{self.node_id}.pkl")
+            except OSError:
+                pass  # the checkpoint can still be served to other peers
+
+    def bootstrap(self):
+        """
+        Initializes the blockchain from the most recent trusted checkpoint, then asks the neighbours only for the blocks
+        created after the checkpoint ("gb" command). Blocks in a trusted checkpoint are not validated again.
+        The hash of a checkpoint identifies its whole content, but anyone can build a checkpoint that matches its own
+        hash, so a checkpoint is trusted only if it is the one in checkpoint_fp, or if its hash is checkpoint_hash or
+        is announced by at least CHECKPOINT_QUORUM neighbours ("ck" command). Only the content of the checkpoint to
+        use is downloaded, from one of the neighbours announcing it ("gc" command)
+        """
+        genesis_hash = self.Blockchain.get_previous_block_hash()
+        checkpoints = list()  # trusted checkpoints with their content
+        if self.checkpoint_fp is not None:
+            try:
+                checkpoint = Checkpoint.load(self.checkpoint_fp)
+                if checkpoint.is_valid(genesis_hash):
+                    checkpoints.append(checkpoint)
+            except (OSError, MalformedDataError):
+                print(f"Server {self.port_no} could not read checkpoint {self.checkpoint_fp}")
+
+        # ASK THE NEIGHBOURS FOR THE INDEX AND THE HASH OF THEIR LAST CHECKPOINT
+        announcements = dict()  # checkpoint_hash -> (index, list of (peer_id, port) of the neighbours announcing it)
+
+        def request_checkpoint_hash(peer_id, port):
+            with self.peer_manager.connect(port, BOOTSTRAP_TIMEOUT) as s:
+                s.sendall(b"ck")
+                announcement = load_received(receive_all(s), (tuple, type(None)))
+            if announcement is not None:
+                if len(announcement) != 2 or not isinstance(announcement[0], int) or \
+                        not isinstance(announcement[1], str):
+                    raise MalformedDataError("malformed checkpoint announcement")
+                index, checkpoint_hash = announcement
+                announcements.setdefault(checkpoint_hash, (index, list()))[1].append((peer_id, port))
+            return True
+
+        self.peer_manager.run_on_peers(request_checkpoint_hash, timeout=BOOTSTRAP_TIMEOUT)
+
+        # DOWNLOAD THE MOST RECENT TRUSTED CHECKPOINT, IF MORE RECENT THAN THE ONE IN checkpoint_fp
+        trusted_announcements = sorted(((index, checkpoint_hash, peers)
+                                        for checkpoint_hash, (index, peers) in announcements.items()
+                                        if len(peers) >= CHECKPOINT_QUORUM or
+                                        checkpoint_hash == self.trusted_checkpoint_hash), reverse=True)
+        for index, checkpoint_hash, peers in trusted_announcements:
+            if checkpoints and index <= checkpoints[0].index:
+                break
+            checkpoint = self.download_checkpoint(checkpoint_hash, peers, genesis_hash)
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+                break
+
+        # USE THE MOST RECENT CHECKPOINT THAT CAN BE BUILT (ALL THE CHECKPOINTS LEFT ARE TRUSTED AND MATCH THEIR HASH)
+        for checkpoint in sorted(checkpoints, key=lambda c: c.index, reverse=True):
+            # build the blockchain and the ledger before taking the lock, a checkpoint that fails is dropped
+            try:
+                ledger = Ledger()
+                ledger.sync(checkpoint.blocks)  # rebuild the state from the blocks instead of trusting a received one
+                blockchain = checkpoint.to_blockchain(ledger)
+            except Exception as e:
+                print(f"Server {self.port_no} could not bootstrap from checkpoint {checkpoint.index}: {e!r}")
+                continue
+            self.blockchain_lock.acquire()
+            self.Blockchain = blockchain
+            self.ledger = ledger
+            self.prev_proof = self.Blockchain.get_previous_proof()
+            self.next_proof = -1
+            with self.checkpoint_lock:
+                self.checkpoint = checkpoint
+                self.checkpoint_index = checkpoint.index
+                self.checkpoint_json = _pickle.dumps(checkpoint)
+            self.blockchain_lock.release()
+            self.update_block_template()
+            break
+
+        # SYNC THE BLOCKS CREATED AFTER THE CHECKPOINT FROM THE FIRST NEIGHBOUR THAT SENDS THEM
+        for peer_id, port in self.peer_manager.get_reachable_peers().items():
+            try:
+                with self.peer_manager.connect(port, BOOTSTRAP_TIMEOUT) as s:
+                    s.sendall(bytes(f"gb|{self.Blockchain.get_previous_index()}", encoding="utf-8"))
+                    payload = load_received(receive_all(s), dict)
+                blocks, transaction_pool = payload.get("blocks"), payload.get("transaction_pool")
+                if not isinstance(blocks, list) or not all(Block.is_well_formed(block) for block in blocks) or \
+                        not isinstance(transaction_pool, list) or \
+                        not all(Transaction.is_well_formed(transaction) for transaction in transaction_pool):
+                    raise MalformedDataError("malformed blocks")
+                if self.add_synced_blocks(blocks, transaction_pool):
+                    break
+            except PEER_ERRORS:
+                self.peer_manager.record_failure(peer_id)
+
+    def download_checkpoint(self, checkpoint_hash, peers, genesis_hash):
+        """
+        Requests the content of the checkpoint with checkpoint_hash ("gc" command) to the peers, one at a time until
+        one of them sends it
+        :param peers: list of (peer_id, port) of the peers announcing the checkpoint
+        :param genesis_hash: current_hash of our genesis block, the first block of the checkpoint must have it
+        :return: Checkpoint object whose content matches checkpoint_hash, None if no peer sent it
+        """
+        for peer_id, port in peers:
+            try:
+                with self.peer_manager.connect(port, BOOTSTRAP_TIMEOUT) as s:
+                    s.sendall(bytes(f"gc|{checkpoint_hash}", encoding="utf-8"))
+                    checkpoint = load_received(receive_all(s), (Checkpoint, type(None)))
+            except PEER_ERRORS:
+                self.peer_manager.record_failure(peer_id)
+                continue
+            # is_valid checks the content against the checkpoint_hash in the checkpoint, which must be the trusted one
+            if checkpoint is not None and checkpoint.is_valid(genesis_hash) and \
+                    checkpoint.checkpoint_hash == checkpoint_hash:
+                return checkpoint
+        return None
+
+    def add_synced_blocks(self, blocks, transaction_pool):
+        """
+        Appends to the blockchain the blocks received with a "gb" command if they follow our last block and are valid
+        :param blocks: list(Block)
+        :param transaction_pool: list of transactions as strings, replaces our pool if the blocks are added
+        :return: True if the blocks have been added, False otherwise
+        """
+        self.blockchain_lock.acquire()
+        try:  # the blocks come from another peer, the lock has to be released even if they are malformed
+            previous_hash = self.Blockchain.get_previous_block_hash()
+            for block in blocks:
+                if block.previous_hash != previous_hash or block.calculate_hash() != block.current_hash or \
+                        not block.is_valid():
+                    return False
+                previous_hash = block.current_hash
+            new_transaction_pool = [Transaction(transaction.split("|")[1], transaction.split("|")[2])
+                                    for transaction in transaction_pool]
+            for block in blocks:
+                self.Blockchain.add_new_block(block)
+                self.ledger.apply_block(block)
+            self.Blockchain.transaction_pool = new_transaction_pool
+            self.prev_proof = self.Blockchain.get_previous_proof()
+            self.next_proof = -1
+            self.update_checkpoint()
+        finally:
+            self.blockchain_lock.release()
+        self.export_checkpoint()
+        self.update_block_template()
+        return True
@@ -0,0 +1,94 @@
+import _pickle
+
+from Block import Block
+from Blockchain import Blockchain
+from Ledger import Ledger
+from Transaction import Transaction
+from lib import calculate_hash, load_received
+
+
+class Checkpoint:
+    def __init__(self, blocks: list, transaction_pool: list):
+        """
+        Creates a snapshot of a blockchain (chain up to its last block and transaction pool)
+        The ledger state is not part of the snapshot: a peer bootstrapping from the checkpoint rebuilds it from the
+        blocks, so that it does not have to trust a state it cannot verify
+        The snapshot is identified by checkpoint_hash, which is computed from its chain, so that a peer receiving the
+        checkpoint can verify it is the one it trusts (see BlockchainServer.bootstrap) before using it. The pool is not
+        part of the hash, as it differs between peers with the same chain: its transactions are validated again
+        when the checkpoint is used
+        :param blocks: list of Block objects, from the genesis block to the last block of the blockchain
+        :param transaction_pool: list of transactions in the pool as strings in the format tx|sender|content
+        """
+        self.index = blocks[-1].index  # index of the last block included in the checkpoint
+        self.blocks = blocks
+        self.transaction_pool = transaction_pool
+        self.checkpoint_hash = self.get_checkpoint_hash()
+
+    def get_checkpoint_hash(self):
+        """
+        Calculates the hash of the checkpoint from its chain
+        :return: digest string
+        """
+        content_to_hash = str(self.index)
+        for block in self.blocks:
+            content_to_hash += str(block.index) + block.previous_hash + block.current_hash
+        return calculate_hash(content_to_hash)
+
+    def is_valid(self, genesis_hash=None):
+        """
+        Checks that the checkpoint content matches its hash and that its blocks form a chain where each block content
+        matches its current_hash. Checkpoints received from other peers are unpickled, so the fields, blocks and
+        transactions are checked to have the expected shape first (see Block.is_well_formed)
+        :param genesis_hash: optional current_hash the first block of the checkpoint must have
+        :return: True if the checkpoint is valid, False otherwise
+        """
+        fields = vars(self)
+        if not isinstance(fields.get("index"), int) or not isinstance(fields.get("checkpoint_hash"), str) or \
+                not isinstance(fields.get("blocks"), list) or not isinstance(fields.get("transaction_pool"), list):
+            return False
+        if not all(Block.is_well_formed(block) for block in self.blocks) or \
+                not all(Transaction.is_well_formed(transaction) for transaction in self.transaction_pool):
+            return False
+        if not self.blocks or self.blocks[-1].index != self.index:
+            return False
+        if genesis_hash is not None and self.blocks[0].current_hash != genesis_hash:
+            return False
+        for previous_block, block in zip(self.blocks, self.blocks[1:]):
+            if block.previous_hash != previous_block.current_hash:
+                return False
+        for block in self.blocks:
+            if block.calculate_hash() != block.current_hash:
+                return False
+        return self.checkpoint_hash == self.get_checkpoint_hash()
+
+    def to_blockchain(self, ledger: Ledger):
+        """
+        :param ledger: Ledger synced to the chain of the checkpoint, the transactions in the pool are validated with it
+        :return: Blockchain object with the chain and the valid transactions in the pool of the checkpoint
+        """
+        blockchain = Blockchain()
+        blockchain.blockchain = list(self.blocks)
+        for transaction in self.transaction_pool:
+            sender, content = transaction.split("|")[1], transaction.split("|")[2]
+            if Transaction(sender, content).validate() and \
+                    ledger.validate_transfer(sender, content, blockchain.peek_transactions(None)):
+                blockchain.add_transaction(Transaction(sender, content))
+        return blockchain
+
+    def export(self, file_path):
+        """
+        Writes the checkpoint to file_path
+        """
+        with open(file_path, "wb") as f:
+            f.write(_pickle.dumps(self))
+
+    @staticmethod
+    def load(file_path):
+        """
+        Reads a checkpoint previously written with export
+        :return: Checkpoint object
+        :raise MalformedDataError: if the file does not contain a checkpoint
+        """
+        with open(file_path, "rb") as f:
+            return load_received(f.read(), Checkpoint)
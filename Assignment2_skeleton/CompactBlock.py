@@ -0,0 +1,90 @@
+import hashlib
+
+from Block import Block
+from lib import MalformedDataError
+
+SHORT_ID_LENGTH = 12  # hex characters of a transaction short id
+
+
+def short_id(transaction: str):
+    """
+    :param transaction: transaction as a string in the format tx|sender|content
+    :return: short id identifying the transaction as a string
+    """
+    return hashlib.sha256(transaction.encode()).hexdigest()[:SHORT_ID_LENGTH]
+
+
+def encode_short_ids(short_ids: list):
+    """
+    :return: the short ids packed in bytes, as they are sent to other peers
+    """
+    return bytes.fromhex("".join(short_ids))
+
+
+def decode_short_ids(data: bytes):
+    """
+    :return: list of short ids from the bytes returned by encode_short_ids
+    :raise MalformedDataError: if data is not made of whole short ids
+    """
+    if not isinstance(data, bytes) or len(data) % (SHORT_ID_LENGTH // 2) != 0:
+        raise MalformedDataError("malformed short ids")
+    data = data.hex()
+    return [data[i:i + SHORT_ID_LENGTH] for i in range(0, len(data), SHORT_ID_LENGTH)]
+
+
+class CompactBlock:
+    def __init__(self, index: int, timestamp: float, proof: int, current_hash: str, short_ids: list):
+        """
+        Compact version of a block to send to other peers: the header of the block and the short ids of its
+        transactions instead of the transactions themselves (other peers have most of them in their pool already)
+        The previous_hash is not sent, the receiver takes it from the block preceding this one
+        """
+        self.index = index
+        self.timestamp = timestamp
+        self.proof = proof
+        self.current_hash = current_hash
+        self.short_ids = short_ids
+
+    @staticmethod
+    def from_block(block: Block):
+        return CompactBlock(block.index, block.timestamp, block.proof, block.current_hash,
+                            [short_id(transaction) for transaction in block.transactions])
+
+    def encode(self):
+        """
+        :return: the compact block as a tuple, which is much smaller than the object once pickled
+        """
+        return self.index, self.timestamp, self.proof, bytes.fromhex(self.current_hash), encode_short_ids(self.short_ids)
+
+    @staticmethod
+    def decode(data: tuple):
+        """
+        :param data: tuple returned by encode
+        :return: CompactBlock object
+        :raise MalformedDataError: if data is not in the format returned by encode
+        """
+        if not isinstance(data, tuple) or len(data) != 5:
+            raise MalformedDataError("malformed compact block")
+        index, timestamp, proof, current_hash, short_ids = data
+        if not isinstance(index, int) or not isinstance(timestamp, (int, float)) or not isinstance(proof, int) or \
+                not isinstance(current_hash, bytes) or len(current_hash) != 32:
+            raise MalformedDataError("malformed compact block header")
+        return CompactBlock(index, timestamp, proof, current_hash.hex(), decode_short_ids(short_ids))
+
+    def to_block(self, previous_hash: str, known_transactions: dict):
+        """
+        Rebuilds the block from the transactions known by the peer
+        :param previous_hash: current_hash of the block preceding this one
+        :param known_transactions: dictionary short id -> transaction as a string
+        :return: Block object, None if some transactions are not known or the rebuilt block does not match its hash
+        """
+        if any(transaction_id not in known_transactions for transaction_id in self.short_ids):
+            return None
+        transactions = [known_transactions[transaction_id] for transaction_id in self.short_ids]
+        block = Block(self.index, transactions, self.proof, previous_hash, self.current_hash)
+        block.timestamp = self.timestamp
+        # the hash does not match if the block does not follow previous_hash or two transactions have the same short id
+        if block.calculate_hash() != self.current_hash:
+            return None
+        return block
+
@@ -0,0 +1,174 @@
+from Block import Block
+
+INITIAL_BALANCE = 100  # balance of an account that has never been part of a transfer
+TRANSFER_PREFIX = "transfer:"  # transaction content of a transfer is transfer:{recipient}:{amount}:{nonce}
+
+
+class Ledger:
+    def __init__(self):
+        """
+        Creates the state derived from the transactions in the blockchain. The state is updated incrementally for each
+        block added to the blockchain, and every update is recorded in an undo log so that the blocks can be rolled
+        back when the blockchain gets replaced
+        """
+        self.transaction_counts = dict()  # sender -> number of transactions of the sender in the blockchain
+        self.balances = dict()  # account -> balance, accounts not in the dictionary have INITIAL_BALANCE
+        self.nonces = dict()  # sender -> nonce of the last transfer applied for the sender
+        # one entry per applied block, in the format (block current_hash, list of (state name, key, previous value))
+        # previous value is None if the key was not in the state
+        self.undo_logs = list()
+
+    @staticmethod
+    def parse_transfer(content):
+        """
+        Parses the content of a transfer transaction
+        :param content: content field of the transaction
+        :return: tuple (recipient, amount, nonce) if the content is a transfer, None otherwise
+        """
+        if not content.startswith(TRANSFER_PREFIX):
+            return None
+        fields = content[len(TRANSFER_PREFIX):].split(":")
+        if len(fields) != 3 or not fields[0] or not fields[1].isdigit() or not fields[2].isdigit():
+            return None
+        return fields[0], int(fields[1]), int(fields[2])
+
+    def get_transaction_count(self, sender):
+        return self.transaction_counts.get(sender, 0)
+
+    def get_balance(self, account):
+        return self.balances.get(account, INITIAL_BALANCE)
+
+    def get_nonce(self, sender):
+        return self.nonces.get(sender, 0)
+
+    def get_height(self):
+        """
+        :return: number of blocks applied to the ledger
+        """
+        return len(self.undo_logs)
+
+    def validate_transfer(self, sender, content, pending_transactions=()):
+        """
+        Checks a transfer against the current state and the pending transfers: the nonce has to be the next one of the
+        sender (a transfer cannot be replayed) and the sender has to own the amount. Transactions that are not
+        transfers are always valid
+        :param pending_transactions: transactions as strings (e.g. the pool) to apply on the state before the check
+        :return: True if the transaction is valid, False otherwise
+        """
+        if not content.startswith(TRANSFER_PREFIX):
+            return True
+        transfer = self.parse_transfer(content)
+        if transfer is None:
+            return False
+        nonces, balances = self.get_pending_state(pending_transactions)
+        return self.check_transfer(sender, transfer, nonces, balances)
+
+    def get_pending_state(self, pending_transactions):
+        """
+        Applies the valid transfers among pending_transactions, in order, on top of the state without modifying it
+        :param pending_transactions: transactions as strings in the format tx|sender|content
+        :return: tuple (nonces, balances) of the accounts touched by the pending transfers
+        """
+        nonces, balances = dict(), dict()
+        for transaction in pending_transactions:
+            sender, content = transaction.split("|")[1], transaction.split("|")[2]
+            transfer = self.parse_transfer(content)
+            if transfer is not None and self.check_transfer(sender, transfer, nonces, balances):
+                recipient, amount, nonce = transfer
+                nonces[sender] = nonce
+                balances[sender] = balances.get(sender, self.get_balance(sender)) - amount
+                balances[recipient] = balances.get(recipient, self.get_balance(recipient)) + amount
+        return nonces, balances
+
+    def check_transfer(self, sender, transfer, nonces, balances):
+        """
+        :param transfer: tuple (recipient, amount, nonce) returned by parse_transfer
+        :param nonces: pending nonces, override the ones in the state
+        :param balances: pending balances, override the ones in the state
+        :return: True if the nonce is the next one of the sender and the sender owns the amount
+        """
+        recipient, amount, nonce = transfer
+        return nonce == nonces.get(sender, self.get_nonce(sender)) + 1 and \
+            0 < amount <= balances.get(sender, self.get_balance(sender))
+
+    def apply_block(self, block: Block):
+        """
+        Updates the state with the transactions in the block. Transfers that are not valid against the state at that
+        point of the blockchain (replayed nonce, insufficient balance) are counted as transactions but move no value
+        :param block: Block object, has to follow the last block applied
+        """
+        undo_log = list()
+        for transaction in block.transactions:
+            sender, content = transaction.split("|")[1], transaction.split("|")[2]
+            self._set("transaction_counts", sender, self.get_transaction_count(sender) + 1, undo_log)
+            transfer = self.parse_transfer(content)
+            if transfer is not None and self.validate_transfer(sender, content):
+                recipient, amount, nonce = transfer
+                self._set("nonces", sender, nonce, undo_log)
+                self._set("balances", sender, self.get_balance(sender) - amount, undo_log)
+                self._set("balances", recipient, self.get_balance(recipient) + amount, undo_log)
+        self.undo_logs.append((block.current_hash, undo_log))
+
+    def undo_block(self):
+        """
+        Rolls back the last block applied to the state
+        """
+        block_hash, undo_log = self.undo_logs.pop()
+        for state_name, key, previous_value in reversed(undo_log):
+            state = getattr(self, state_name)
+            if previous_value is None:
+                state.pop(key)
+            else:
+                state[key] = previous_value
+
+    def sync(self, blocks):
+        """
+        Brings the state in line with a (possibly different) chain: rolls back the applied blocks that are not in the
+        chain and applies the blocks of the chain that are missing. Only the blocks after the last common block are
+        touched
+        :param blocks: list of Block objects, from the genesis block
+        """
+        common_height = min(len(blocks), self.get_height())
+        while common_height > 0 and self.undo_logs[common_height - 1][0] != blocks[common_height - 1].current_hash:
+            common_height -= 1
+        while self.get_height() > common_height:
+            self.undo_block()
+        for block in blocks[common_height:]:
+            self.apply_block(block)
+
+    @staticmethod
+    def check_sync():
+        """
+        Checks that syncing a ledger from a chain to a fork of it (and back) gives the same state as syncing an empty
+        ledger to the fork, i.e. that undoing the blocks of a chain restores the state exactly
+        :return: True if the states match, False otherwise
+        """
+        def extend(chain, transactions):
+            return chain + [Block(chain[-1].index + 1, transactions, chain[-1].index, chain[-1].current_hash)]
+
+        def state(ledger):
+            return ledger.transaction_counts, ledger.balances, ledger.nonces, [log[0] for log in ledger.undo_logs]
+
+        genesis = [Block(1, [], 100, "This block has no previous hash")]
+        common = extend(genesis, ["tx|aaaa1111|transfer:bbbb2222:30:1", "tx|cccc3333|hello"])
+        # fork_a moves value to an account that only exists in it, and contains an overdraft and a replayed nonce
+        fork_a = extend(common, ["tx|aaaa1111|transfer:dddd4444:50:2", "tx|dddd4444|transfer:bbbb2222:20:1"])
+        fork_a = extend(fork_a, ["tx|bbbb2222|transfer:aaaa1111:500:1", "tx|aaaa1111|transfer:dddd4444:10:2"])
+        # fork_b is longer and spends the same nonce of aaaa1111 differently
+        fork_b = extend(common, ["tx|aaaa1111|transfer:cccc3333:60:2"])
+        fork_b = extend(fork_b, ["tx|cccc3333|transfer:aaaa1111:5:1", "tx|eeee5555|hello"])
+        fork_b = extend(fork_b, ["tx|bbbb2222|transfer:cccc3333:130:1"])
+
+        ledger = Ledger()
+        for chain in (fork_a, fork_b, common, fork_a, genesis, fork_b):
+            ledger.sync(chain)
+            fresh_ledger = Ledger()
+            fresh_ledger.sync(chain)
+            if state(ledger) != state(fresh_ledger):
+                return False
+        return True
+
+    def _set(self, state_name, key, value, undo_log):
+        state = getattr(self, state_name)
+        undo_log.append((state_name, key, state.get(key)))
+        state[key] = value
@@ -0,0 +1,131 @@
+import socket
+import threading
+import time
+
+from lib import MalformedDataError
+
+HOST = "127.0.0.1"
+# errors a task raises when a peer does not answer or answers with something malformed, other errors are not the
+# peer's fault and are not caught
+PEER_ERRORS = (socket.error, MalformedDataError)
+CONNECT_TIMEOUT = 1  # seconds a connect/send/recv with a neighbour can take before the neighbour is considered unresponsive
+BASE_BACKOFF = 5  # seconds to wait before retrying a peer after its first failure (doubles at each consecutive failure)
+MAX_BACKOFF = 60  # upper bound for the backoff of a failed peer
+
+
+class PeerManager:
+    def __init__(self):
+        """
+        Keeps track of the neighbours of the peer and of their health.
+        Each neighbour is stored as peer_id -> {"port": int, "failures": int, "next_retry": float}, where failures is
+        the number of consecutive failed contacts and next_retry the time before which the peer is not contacted again
+        """
+        self.peers = dict()
+        self.lock = threading.Lock()  # peers can join/leave while heartbeats and broadcasts are iterating
+        # (task, peer_id) of the tasks started by run_on_peers that have not ended yet
+        self.running_tasks = set()
+
+    def add_peer(self, peer_id, port):
+        """
+        Adds a neighbour to the known peers (or resets its health if already known)
+        :param peer_id: id of the peer (e.g. "A")
+        :param port: port number of the peer's server role
+        """
+        with self.lock:
+            self.peers[peer_id] = {"port": int(port), "failures": 0, "next_retry": 0}
+
+    def remove_peer(self, peer_id):
+        """
+        Removes a neighbour from the known peers, does nothing if the peer is unknown
+        """
+        with self.lock:
+            self.peers.pop(peer_id, None)
+
+    def get_reachable_peers(self):
+        """
+        Returns the peers that are worth contacting now, i.e. the ones that answered last time and the failed ones whose
+        backoff expired
+        :return: dictionary peer_id -> port
+        """
+        now = time.time()
+        with self.lock:
+            return {peer_id: peer["port"] for peer_id, peer in self.peers.items() if peer["next_retry"] <= now}
+
+    def record_success(self, peer_id):
+        """
+        Clears the backoff of the peer
+        """
+        with self.lock:
+            if peer_id in self.peers:
+                peer = self.peers[peer_id]
+                peer["failures"] = 0
+                peer["next_retry"] = 0
+
+    def record_failure(self, peer_id):
+        """
+        Pushes the next retry of the peer further with exponential backoff
+        """
+        with self.lock:
+            if peer_id in self.peers:
+                peer = self.peers[peer_id]
+                peer["failures"] += 1
+                backoff = min(BASE_BACKOFF * 2 ** (peer["failures"] - 1), MAX_BACKOFF)
+                peer["next_retry"] = time.time() + backoff
+
+    def connect(self, port, timeout=CONNECT_TIMEOUT):
+        """
+        Opens a connection to a server role with a bounded connect time. The returned socket keeps the timeout for
+        the following send/recv calls, so that an unresponsive peer cannot block the caller forever
+        :param port: port of the server role to connect to
+        :param timeout: seconds after which the connect (and any later socket operation) fails
+        :return: connected socket
+        """
+        return socket.create_connection((HOST, int(port)), timeout=timeout)
+
+    def run_on_peers(self, task, timeout=None):
+        """
+        Runs task(peer_id, port) in parallel for every reachable peer and updates the health of each peer from
+        the outcome of the task (True if the peer answered, False otherwise). A task raising one of PEER_ERRORS counts
+        as a failure of the peer. A task still running on a peer (e.g. a sync that outlived the previous heartbeat
+        round) is not started again on that peer until it ends
+        :param task: function taking peer_id and port and returning a boolean
+        :param timeout: optional number of seconds to wait for all the tasks to complete
+        """
+        threads = list()
+        for peer_id, port in self.get_reachable_peers().items():
+            with self.lock:
+                if (task, peer_id) in self.running_tasks:
+                    continue
+                self.running_tasks.add((task, peer_id))
+            thread = threading.Thread(target=self._run_task, args=(task, peer_id, port), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        deadline = time.time() + timeout if timeout is not None else None
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - time.time(), 0))
+
+    def broadcast(self, message):
+        """
+        Sends message to all the reachable peers in parallel without waiting for a response
+        :param message: string to send
+        """
+        def send(peer_id, port):
+            with self.connect(port) as s:
+                s.sendall(bytes(message, encoding="utf-8"))
+            return True
+
+        self.run_on_peers(send)
+
+    def _run_task(self, task, peer_id, port):
+        try:
+            succeeded = task(peer_id, port)
+        except PEER_ERRORS:
+            succeeded = False
+        finally:
+            with self.lock:
+                self.running_tasks.discard((task, peer_id))
+        if succeeded:
+            self.record_success(peer_id)
+        else:
+            self.record_failure(peer_id)
@@ -0,0 +1,176 @@
+import threading
+import time
+
+from lib import calculate_hash
+
+PROOF_DIFFICULTY = "00"  # prefix of the hash of a valid proof
+SHARE_DIFFICULTY = "0"  # prefix of the hash of a share, a proof of work easier than the next proof
+HASHES_PER_SHARE = 16 ** len(SHARE_DIFFICULTY)  # hashes a miner computes on average for each share it finds
+WORK_SECONDS = 2  # seconds of work a range assigned to a miner should take at the miner's hash rate
+MIN_RANGE_SIZE = 256  # nonces in the range of a miner whose hash rate is not known yet
+MAX_RANGE_SIZE = 1000000
+MINER_TIMEOUT = 5  # seconds without requests after which a miner is dropped and its range assigned to other miners
+SHARE_SAMPLE_SIZE = 100  # shares a miner sends with each submission, the other shares found are only counted
+
+
+class PoolCoordinator:
+    def __init__(self):
+        """
+        Splits the search of the next proof among any number of miners attached to the server role. Each job is the
+        search of the next proof for a prev_proof, and each miner gets disjoint ranges of nonces of the current job.
+        Miners also submit shares (nonces whose hash meets the easier SHARE_DIFFICULTY), which are used to measure
+        their hash rate and to size their ranges
+        """
+        self.lock = threading.Lock()
+        self.job_id = 0
+        self.prev_proof = None  # prev_proof of the current job
+        self.previous_prev_proof = None  # prev_proof of the previous job
+        self.next_nonce = 1  # first nonce of the current job not assigned yet (0 is not accepted as a proof)
+        self.free_ranges = list()  # ranges of the current job taken back from dropped miners, as (start, end)
+        # miner_id -> {"last_seen": float, "shares": int, "work_seconds": float, "ranges": dict}
+        # ranges is job_id -> (start, end, assigned_at) of the ranges assigned to the miner and not submitted yet
+        self.miners = dict()
+        self.next_miner_id = 1
+
+    def register_miner(self):
+        """
+        :return: id assigned to the new miner
+        """
+        with self.lock:
+            miner_id = self.next_miner_id
+            self.next_miner_id += 1
+            self.miners[miner_id] = {"last_seen": time.time(), "shares": 0, "work_seconds": 0, "ranges": dict()}
+            return miner_id
+
+    def get_work(self, miner_id, prev_proof, needs_proof):
+        """
+        Returns the work the miner has to do, as { "job_id": int, "prev_proof": int, "start": int, "end": int,
+        "share_difficulty": str, "proof_difficulty": str }. The miner keeps the same range until it submits it, and
+        gets a new range once the job changes. start and end are None if the server does not need a proof
+        :param miner_id: id of the miner asking for work
+        :param prev_proof: proof of the last block in the blockchain
+        :param needs_proof: False if the server already has the next proof
+        :return: dictionary with the work, None if the miner is not registered (or has been dropped)
+        """
+        with self.lock:
+            now = time.time()
+            self.drop_inactive_miners(now)
+            if miner_id not in self.miners:
+                return None
+            miner = self.miners[miner_id]
+            miner["last_seen"] = now
+
+            if prev_proof != self.prev_proof:
+                # THE TIP CHANGED, THE WORK ON THE PREVIOUS JOB IS CANCELLED
+                self.job_id += 1
+                self.previous_prev_proof = self.prev_proof
+                self.prev_proof = prev_proof
+                self.next_nonce = 1
+                self.free_ranges = list()
+            # ranges of older jobs cannot be submitted anymore (the ones of the previous job can, for share accounting)
+            miner["ranges"] = {job_id: work_range for job_id, work_range in miner["ranges"].items()
+                               if job_id >= self.job_id - 1}
+
+            work = {
+                "job_id": self.job_id,
+                "prev_proof": prev_proof,
+                "start": None,
+                "end": None,
+                "share_difficulty": SHARE_DIFFICULTY,
+                "proof_difficulty": PROOF_DIFFICULTY
+            }
+            if needs_proof:
+                if self.job_id not in miner["ranges"]:
+                    miner["ranges"][self.job_id] = self.assign_range(miner) + (now,)
+                work["start"], work["end"] = miner["ranges"][self.job_id][:2]
+            return work
+
+    def submit(self, miner_id, job_id, share_count, shares):
+        """
+        Credits the miner with the shares it found in the range assigned to it for job_id. A range can be
+        submitted only once, after that the miner gets a new range at its next request of work
+        Only a sample of the shares is sent and verified: if the whole sample is valid the miner is credited with the
+        number of shares it reported, up to twice the shares expected in its range, otherwise only with the valid ones
+        :param miner_id: id of the miner
+        :param job_id: id of the job the shares have been found for
+        :param share_count: number of shares the miner found in the range
+        :param shares: list of nonces, the first SHARE_SAMPLE_SIZE shares found
+        :return: number of accepted shares, None if the miner has no range for the job (stale job or unknown miner)
+        """
+        with self.lock:
+            if miner_id not in self.miners or job_id not in self.miners[miner_id]["ranges"]:
+                return None
+            miner = self.miners[miner_id]
+            start, end, assigned_at = miner["ranges"].pop(job_id)
+            if job_id == self.job_id:
+                prev_proof = self.prev_proof
+            elif job_id == self.job_id - 1:
+                prev_proof = self.previous_prev_proof
+            else:
+                return None
+
+        # verify the shares outside of the lock, it takes one hash for each share
+        shares = set(shares[:SHARE_SAMPLE_SIZE])
+        accepted_shares = 0
+        for nonce in shares:
+            if start <= nonce < end and calculate_hash(nonce ** 2 - prev_proof ** 2).startswith(SHARE_DIFFICULTY):
+                accepted_shares += 1
+        if accepted_shares == len(shares) == min(share_count, SHARE_SAMPLE_SIZE):
+            accepted_shares = max(accepted_shares, min(share_count, 2 * (end - start) // HASHES_PER_SHARE))
+
+        with self.lock:
+            miner["last_seen"] = time.time()
+            miner["shares"] += accepted_shares
+            miner["work_seconds"] += time.time() - assigned_at
+        return accepted_shares
+
+    def get_job_prev_proof(self, job_id):
+        """
+        :return: prev_proof of the job if it is the current one, None otherwise
+        """
+        with self.lock:
+            return self.prev_proof if job_id == self.job_id else None
+
+    def get_hash_rate(self, miner):
+        """
+        :return: estimated hashes per second of the miner, from the shares it submitted
+        """
+        if miner["work_seconds"] == 0:
+            return 0
+        return miner["shares"] * HASHES_PER_SHARE / miner["work_seconds"]
+
+    def get_statistics(self):
+        """
+        :return: dictionary miner_id -> { "hash_rate": float, "shares": int }
+        """
+        with self.lock:
+            return {miner_id: {"hash_rate": self.get_hash_rate(miner), "shares": miner["shares"]}
+                    for miner_id, miner in self.miners.items()}
+
+    def assign_range(self, miner):
+        """
+        Takes the next range of nonces of the current job for the miner, sized on the miner's hash rate.
+        Has to be called while holding the lock
+        :return: tuple (start, end)
+        """
+        size = min(max(int(self.get_hash_rate(miner) * WORK_SECONDS), MIN_RANGE_SIZE), MAX_RANGE_SIZE)
+        if self.free_ranges:
+            start, end = self.free_ranges.pop()
+            if end - start > size:
+                self.free_ranges.append((start + size, end))
+                end = start + size
+        else:
+            start, end = self.next_nonce, self.next_nonce + size
+            self.next_nonce = end
+        return start, end
+
+    def drop_inactive_miners(self, now):
+        """
+        Removes the miners that have not requested work for MINER_TIMEOUT seconds, their range of the current job
+        will be assigned to other miners. Has to be called while holding the lock
+        """
+        for miner_id in [miner_id for miner_id, miner in self.miners.items() if now - miner["last_seen"] > MINER_TIMEOUT]:
+            miner = self.miners.pop(miner_id)
+            if self.job_id in miner["ranges"]:
+                start, end, assigned_at = miner["ranges"][self.job_id]
+                self.free_ranges.append((start, end))
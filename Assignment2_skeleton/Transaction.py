@@ -18,6 +18,15 @@ class Transaction:
             return False
         return True
 
+    @staticmethod
+    def is_well_formed(transaction):
+        """
+        Checks that transaction is a string in the format tx|sender|content, as the transactions in blocks and pools
+        (sender and content are not validated, see validate)
+        :return: True if the transaction can be split into its fields, False otherwise
+        """
+        return isinstance(transaction, str) and transaction.startswith("tx|") and len(transaction.split("|")) == 3
+
     def get_as_string(self):
         """
         Returns the transaction in the form tx|[sender]|[content]
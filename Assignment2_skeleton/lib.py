@@ -1,7 +1,14 @@
+import _pickle
 import hashlib
 import json
 
 
+class MalformedDataError(Exception):
+    """
+    Raised when the data received from another peer cannot be decoded or does not have the expected shape
+    """
+
+
 def calculate_hash(data):
     """
     Hashes data with sha256 and returns the digest
@@ -13,3 +20,36 @@ def calculate_hash(data):
     raw_hash = hashlib.sha256(data_json_encoded)
     digest = raw_hash.hexdigest()
     return digest
+
+
+def receive_all(s):
+    """
+    Receives data from the socket until the other end closes the connection. Used for payloads that might not fit in a
+    single recv (e.g. checkpoints), the sender has to close the connection after sending
+    :param s: connected socket
+    :return: received bytes
+    """
+    chunks = list()
+    while True:
+        chunk = s.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def load_received(data: bytes, expected_type):
+    """
+    Unpickles data received from another peer and checks its type
+    :param data: received bytes
+    :param expected_type: type (or tuple of types) the unpickled object must have
+    :return: the unpickled object
+    :raise MalformedDataError: if data cannot be unpickled or is not of expected_type
+    """
+    try:
+        loaded = _pickle.loads(data)
+    except Exception as e:  # unpickling data that might have been built with anything in it can raise any error
+        raise MalformedDataError(f"cannot unpickle received data: {e!r}") from e
+    if not isinstance(loaded, expected_type):
+        raise MalformedDataError(f"received {type(loaded).__name__} instead of {expected_type}")
+    return loaded